@@ -0,0 +1,50 @@
+"""Posts
+
+Revision ID: 8d0c5e2a41f7
+Revises: 112a78fc9ecd
+Create Date: 2026-10-15 10:11:52.107214
+
+"""
+import sqlalchemy as sa
+
+from alembic import context, op
+
+# revision identifiers, used by Alembic.
+revision = "8d0c5e2a41f7"
+down_revision = "112a78fc9ecd"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The posts table was previously only created by the API on startup (with metadata.create_all),
+    # so it might already exist, in which case there's nothing to do.
+    if context.is_offline_mode():
+        # There's no database to inspect when only generating the SQL, make the statements conditional instead
+        op.execute(
+            "CREATE TABLE IF NOT EXISTS posts ("
+            "id SERIAL NOT NULL, user_id INTEGER, title VARCHAR, body VARCHAR, PRIMARY KEY (id))"
+        )
+        op.execute("CREATE INDEX IF NOT EXISTS ix_posts_id ON posts (id)")
+        return
+
+    if sa.inspect(op.get_bind()).has_table("posts"):
+        return
+
+    op.create_table(
+        "posts",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("title", sa.String(), nullable=True),
+        sa.Column("body", sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_posts_id"), "posts", ["id"], unique=False)
+
+
+def downgrade() -> None:
+    # NOTE: This drops the posts table along with ALL OF THE STORED POSTS, even if the table wasn't created
+    # by the upgrade (but by the API's create_all before the migrations managed it), as there's no record
+    # of which one was the case. Back up the posts before downgrading past this revision.
+    op.drop_index(op.f("ix_posts_id"), table_name="posts")
+    op.drop_table("posts")
@@ -0,0 +1,40 @@
+"""Posts user_id index
+
+Revision ID: cfe4cdd5de74
+Revises: 8d0c5e2a41f7
+Create Date: 2026-10-15 10:12:37.418256
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "cfe4cdd5de74"
+down_revision = "8d0c5e2a41f7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The table might already hold a lot of posts, build the index concurrently, to avoid locking the
+    # table against writes while it's being built (this can't be done from within a transaction).
+    with op.get_context().autocommit_block():
+        # A failed concurrent build leaves an INVALID index behind, drop it so that it can be built again
+        op.execute(
+            """
+            DO $$
+            BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM pg_index WHERE indexrelid = to_regclass('ix_posts_user_id') AND NOT indisvalid
+                ) THEN
+                    DROP INDEX ix_posts_user_id;
+                END IF;
+            END $$
+            """
+        )
+        # Alembic only supports IF (NOT) EXISTS for indexes with SQLAlchemy 2.0, emit the statements directly
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_user_id ON posts (user_id)")
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_posts_user_id")
@@ -10,8 +10,8 @@ async def main() -> tuple[str, int]:
     async with engine.begin() as conn:
         await conn.run_sync(models.Base.metadata.create_all)
 
-    async with SessionLocal() as db_session:
-        member = await generate_member(db_session, is_admin=True)
+    async with SessionLocal() as db_session, db_session.begin():
+        member = await generate_member(is_admin=True, session=db_session)
 
     return member.api_token, member.member_id
 
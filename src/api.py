@@ -1,95 +1,179 @@
 import asyncio
 import logging
-from collections.abc import Awaitable, Callable
-from typing import cast
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 
 import aioredis
 import aioredis.exceptions
 import httpx
 from fastapi import FastAPI
 from fastapi.requests import Request
-from fastapi.responses import RedirectResponse, Response
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from src.constants import Connection, Server
+from src.constants import Connection, Logging, Server
 from src.endpoints import admin, user_posts
 from src.models import Base
-from src.utils.database import SessionLocal, engine
+from src.utils.cache import _request_redis
+from src.utils.database import SessionLocal, _request_session, discard_after_commit, engine, run_after_commit
 from src.utils.log import setup_logging
 
 log = logging.getLogger(__name__)
 
-app = FastAPI(docs_url=None, redoc_url=None)
-app.mount("/static", StaticFiles(directory="src/static"), name="static")
+app = FastAPI(docs_url=None, redoc_url=None, default_response_class=ORJSONResponse)
+if not Server.STATIC_VIA_PROXY:
+    app.mount("/static", StaticFiles(directory="src/static"), name="static")
 app.include_router(user_posts.router)
+app.include_router(user_posts.member_router)
 app.include_router(admin.router)
 
 
-async def _init_database(retry_time: float = 3) -> AsyncSession:
-    """Try to connect to the database, keep retrying if we fail."""
-    log.debug("Connecting to the database")
-    try:
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
-    except ConnectionRefusedError:
-        log.exception(f"Database connection failed, retrying in {retry_time} seconds...")
-        await asyncio.sleep(retry_time)
-        return await _init_database(retry_time)
-    else:
-        log.debug("Database connection established")
-
-    return cast(AsyncSession, SessionLocal())
-
-
-async def _init_redis(retry_time: float = 3) -> aioredis.Redis:
-    """Try to connect to redis, keep retrying if we fail."""
-    log.debug("Connecting to redis")
-    redis_pool = aioredis.from_url(
+async def _init_database(retry_time: float = 3, max_attempts: int = 20) -> None:
+    """Try to connect to the database, keep retrying (up to `max_attempts` times) if we fail."""
+    for attempt in range(1, max_attempts + 1):
+        log.debug("Connecting to the database")
+        try:
+            async with engine.begin() as conn:
+                # Outside of debug mode, the schema is managed by alembic migrations, so we can skip
+                # the (fairly slow) schema introspection needed to create the missing tables
+                if Logging.DEBUG:
+                    await conn.run_sync(Base.metadata.create_all)
+        except ConnectionRefusedError:
+            if attempt == max_attempts:
+                raise
+            log.exception("Database connection failed, retrying in %s seconds...", retry_time)
+            await asyncio.sleep(retry_time)
+        else:
+            log.debug("Database connection established")
+            return
+
+
+async def _init_redis(retry_time: float = 3, max_attempts: int = 20) -> aioredis.Redis:
+    """Try to connect to redis, keep retrying (up to `max_attempts` times) if we fail."""
+    # Use a bounded pool shared by all requests, blocking (rather than erroring) when
+    # all of the connections are currently in use
+    redis_pool = aioredis.BlockingConnectionPool.from_url(
         Connection.REDIS_URL,
+        max_connections=Connection.REDIS_POOL_SIZE,
         encoding="utf-8",
         decode_responses=True,
     )
-    try:
-        # Redis is initialized lazily, without actually making a connection.
-        # to ensure that the instance is up and connection can be made,
-        # ping the instance here on initialization
-        await redis_pool.ping()
-    except aioredis.exceptions.ConnectionError:
-        log.exception(f"Redis connection failed, retrying in {retry_time} seconds...")
-        await asyncio.sleep(retry_time)
-        return await _init_redis(retry_time)
-    else:
-        log.debug("Redis connection established")
-    return redis_pool
-
-
-@app.on_event("startup")
-async def startup() -> None:
-    """Perform initial setup and establish connections/sessions."""
+    redis = aioredis.Redis(connection_pool=redis_pool)
+
+    for attempt in range(1, max_attempts + 1):
+        log.debug("Connecting to redis")
+        try:
+            # Redis is initialized lazily, without actually making a connection.
+            # to ensure that the instance is up and connection can be made,
+            # ping the instance here on initialization
+            await redis.ping()
+        except aioredis.exceptions.ConnectionError:
+            if attempt == max_attempts:
+                await redis_pool.disconnect()
+                raise
+            log.exception("Redis connection failed, retrying in %s seconds...", retry_time)
+            await asyncio.sleep(retry_time)
+        else:
+            log.debug("Redis connection established")
+            break
+
+    return redis
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Perform initial setup and establish connections/sessions, closing them once the server stops."""
     setup_logging()
 
     log.info("API Server starting...")
-    app.state.httpx_client = httpx.AsyncClient()
-    app.state.db_session = _init_database()
-    app.state.redis_pool = _init_redis()
-
-
-@app.on_event("shutdown")
-async def shutdown() -> None:
-    """Close the connections/sessions."""
-    log.info("API Server stopping...")
-    await engine.dispose()
-    await app.state.httpx_client.aclose()
-    await app.state.db_session.close()
-
-
-@app.middleware("http")
-async def setup_data(request: Request, callnext: Callable[[Request], Awaitable[Response]]) -> Response:
-    """Attach references to database session for the request."""
-    request.state.httpx_client = app.state.httpx_client
-    request.state.db_session = app.state.db_session
-    return await callnext(request)
+    # The docs page is fully static, render it just once, rather than on every request
+    app.state.docs_html = Server.TEMPLATES.get_template("docs.html").render().encode()
+    # A single client shared by all requests, reusing the (keep-alive) connections to the external API
+    async with httpx.AsyncClient(
+        base_url=Connection.API_BASE_URL,
+        http2=True,
+        # Keep idle connections open for longer than the default 5 seconds, so that the sporadic
+        # lookups don't need to go through a new TCP + TLS handshake
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=200, keepalive_expiry=60),
+        timeout=httpx.Timeout(5.0, connect=1.0),
+    ) as httpx_client:
+        app.state.httpx_client = httpx_client
+        await _init_database()
+        app.state.redis = await _init_redis()
+
+        yield
+
+        log.info("API Server stopping...")
+        await engine.dispose()
+        await app.state.redis.close()
+        await app.state.redis.connection_pool.disconnect()
+
+
+# FastAPI doesn't yet accept the lifespan context manager directly, set it on the underlying starlette router
+app.router.lifespan_context = lifespan
+
+
+class SessionMiddleware:
+    """
+    Pure ASGI middleware attaching references to a fresh database session (and shared clients) for the request.
+
+    This is intentionally not implemented with `@app.middleware("http")`, since that goes
+    through starlette's BaseHTTPMiddleware, which runs the rest of the app in a separate
+    task and streams the response back through memory object streams for every request.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = scope.setdefault("state", {})
+        state["httpx_client"] = scope["app"].state.httpx_client
+        state["redis"] = scope["app"].state.redis
+        # Client's IP address, used as the bucket key of IP based ratelimits
+        client = scope.get("client")
+        state["bucket_ip"] = client[0] if client else None
+        redis_token = _request_redis.set(state["redis"])
+        try:
+            # Run the whole request within a single transaction, rolled back on unhandled errors and error responses
+            async with SessionLocal() as db_session:
+                async with db_session.begin():
+
+                    async def send_wrapper(message: Message) -> None:
+                        # Commit the transaction before sending out the response, so that once the client receives
+                        # the response, the changes are visible to other requests (and errors on commit are reported)
+                        if message["type"] == "http.response.start" and db_session.in_transaction():
+                            if message["status"] >= 400:
+                                # Error responses (including handled ones, such as HTTPExceptions) never keep
+                                # any of the changes made while handling the request
+                                await db_session.rollback()
+                                discard_after_commit(db_session)
+                            else:
+                                await db_session.commit()
+                                # Only invalidate the cached data now, invalidating it within the transaction would
+                                # allow concurrent requests to cache the old data again before the commit
+                                await run_after_commit(db_session)
+                        await send(message)
+
+                    state["db_session"] = db_session
+                    session_token = _request_session.set(db_session)
+                    try:
+                        await self.app(scope, receive, send_wrapper)
+                    finally:
+                        _request_session.reset(session_token)
+
+                # In case the transaction was only committed on exiting the block, rather than before sending
+                # the response (if it was rolled back due to an exception, we don't get here at all)
+                await run_after_commit(db_session)
+        finally:
+            _request_redis.reset(redis_token)
+
+
+app.add_middleware(SessionMiddleware)
 
 
 @app.get("/", include_in_schema=False)
@@ -103,4 +187,4 @@ async def info(request: Request) -> Response:
 @app.get("/docs", include_in_schema=False)
 async def docs(request: Request) -> Response:
     """Return rendered API docs page."""
-    return Server.TEMPLATES.TemplateResponse("docs.html", {"request": request})
+    return HTMLResponse(request.app.state.docs_html)
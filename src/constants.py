@@ -1,4 +1,5 @@
 from collections.abc import Callable
+from functools import cache
 from typing import NewType, Optional, TypeVar, Union, cast, overload
 
 from decouple import config
@@ -8,6 +9,7 @@ T = TypeVar("T")
 V = TypeVar("V")
 Sentinel = NewType("Sentinel", object)
 _MISSING = cast(Sentinel, object())
+_IDENTITY = lambda x: x
 
 
 @overload
@@ -26,9 +28,12 @@ def _get_config(
     default: object = _MISSING,
 ) -> object:
     """Wrapper around decouple.config that can handle typing better."""
-    if cast is None:
-        cast = lambda x: x
+    return _resolve_config(search_path, _IDENTITY if cast is None else cast, default)
 
+
+@cache
+def _resolve_config(search_path: str, cast: Callable[[str], object], default: object) -> object:
+    """Obtain the config value from decouple, caching the result for repeated lookups."""
     if default is not _MISSING:
         obj = config(search_path, cast=cast, default=default)
     else:
@@ -49,7 +54,11 @@ class Connection:
     """Config related to external connections (such as to a database)."""
 
     DATABASE_URL = _get_config("DATABASE_URL")
+    DB_POOL_SIZE = _get_config("DB_POOL_SIZE", cast=int, default=20)
+    DB_MAX_OVERFLOW = _get_config("DB_MAX_OVERFLOW", cast=int, default=10)
+    DB_STATEMENT_CACHE_SIZE = _get_config("DB_STATEMENT_CACHE_SIZE", cast=int, default=500)
     REDIS_URL = _get_config("REDIS_URL")
+    REDIS_POOL_SIZE = _get_config("REDIS_POOL_SIZE", cast=int, default=50)
     API_BASE_URL = _get_config("API_BASE_URL", default="https://jsonplaceholder.typicode.com")
 
 
@@ -58,6 +67,8 @@ class Server:
 
     JWT_SECRET = _get_config("JWT_SECRET")
     SHOW_ADMIN_ENDPOINTS = Logging.DEBUG
+    # When set, static files are expected to be served by a reverse proxy in front of the API
+    STATIC_VIA_PROXY = _get_config("STATIC_VIA_PROXY", cast=bool, default=False)
     TEMPLATES = Jinja2Templates(directory="src/templates")
 
 
@@ -67,3 +78,11 @@ class Ratelimits:
     REQUESTS_PER_PERIOD = _get_config("REQUESTS_PER_PERIOD", cast=int, default=3)
     TIME_PERIOD = _get_config("TIME_PERIOD", cast=float, default=20)  # in seconds
     COOLDOWN_PERIOD = _get_config("COOLDOWN_PERIOD", cast=float, default=100)  # in seconds
+
+
+class Caching:
+    """Config related to caching data in redis."""
+
+    USER_EXISTS_TTL = _get_config("USER_EXISTS_CACHE_TTL", cast=int, default=3600)  # in seconds
+    MODEL_TTL = _get_config("MODEL_CACHE_TTL", cast=int, default=300)  # in seconds
+    NEGATIVE_TTL = _get_config("NEGATIVE_CACHE_TTL", cast=int, default=60)  # in seconds
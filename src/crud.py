@@ -4,109 +4,187 @@ C: Create
 R: Read
 U: Update
 D: Delete
+
+These functions only flush their changes, committing the transaction is left up to the caller
+(for requests, this is done by the session middleware, once the request is handled). The cached
+data of the changed models is only invalidated once the changes are committed.
+
+By default, the session of the currently handled request is used, a different session (e.g. outside
+of requests) can be passed explicitly with the `session` keyword argument.
 """
-from typing import Optional
+from collections.abc import Collection
+from functools import partial
+from typing import Any, Optional, Union
 
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from src import models, schemas
+from src.constants import Caching
+from src.utils.cache import cache_delete, cache_get, cache_set
+from src.utils.database import call_after_commit, resolve_session
+
+
+def _as_dict(db_model: Union[models.Post, models.Member]) -> dict[str, Any]:
+    """Convert given database model into a dict of its column values, which can be cached."""
+    return {column.name: getattr(db_model, column.name) for column in db_model.__table__.columns}
+
 
 # region: Post
 
 
-async def get_post(session: AsyncSession, id: int) -> Optional[models.Post]:
-    stmt = select(models.Post).filter(models.Post.id == id)
-    r = await session.execute(stmt)
-    db_model = r.scalars().first()
+async def get_post(id: int, *, session: Optional[AsyncSession] = None) -> Optional[models.Post]:
+    cached = await cache_get(f"post:{id}")
+    if cached is not None:
+        return models.Post(**cached)
+
+    db_model = await _get_db_post(id, session=session)
+    if db_model is not None:
+        await cache_set(f"post:{id}", _as_dict(db_model), Caching.MODEL_TTL)
     return db_model
 
 
-async def add_post(session: AsyncSession, schema: schemas.PostCreate) -> models.Post:
-    db_model = models.Post(**schema.dict())
-    session.add(db_model)
-    await session.commit()
-    await session.refresh(db_model)
+async def _get_db_post(id: int, *, session: Optional[AsyncSession] = None) -> Optional[models.Post]:
+    """Obtain the post from the database directly, bypassing the cache (needed when modifying the post)."""
+    session = resolve_session(session)
+    # Primary key lookup, which can be served from the session's identity map without a query
+    return await session.get(models.Post, id)
+
+
+async def get_posts_bulk(ids: Collection[int], *, session: Optional[AsyncSession] = None) -> dict[int, models.Post]:
+    """Obtain all posts with given ids in a single query, returning a mapping of post id -> post."""
+    session = resolve_session(session)
+    stmt = select(models.Post).where(models.Post.id.in_(ids))
+    r = await session.scalars(stmt)
+    return {db_model.id: db_model for db_model in r}
+
+
+async def add_post(schema: schemas.PostCreate, *, session: Optional[AsyncSession] = None) -> models.Post:
+    session = resolve_session(session)
+    # Insert the post and obtain the stored row within a single INSERT ... RETURNING query,
+    # without going through the unit of work flush
+    stmt = insert(models.Post).values(**schema.dict()).returning(models.Post)
+    r = await session.execute(select(models.Post).from_statement(stmt))
+    db_model = r.scalar_one()
+    # The new post could've been remembered as missing (negative cache) by an earlier lookup of its id
+    call_after_commit(partial(cache_delete, f"negcache:post:{db_model.id}"), session=session)
     return db_model
 
 
-async def delete_post(session: AsyncSession, post_id: int) -> bool:
-    db_model = await get_post(session, post_id)
+async def store_post(schema: schemas.Post, *, session: Optional[AsyncSession] = None) -> None:
+    """
+    Store a post with a known id (e.g. obtained from the API).
+
+    If a post with this id was already stored (e.g. by a concurrent request), this does nothing.
+    """
+    session = resolve_session(session)
+    stmt = insert(models.Post).values(**schema.dict()).on_conflict_do_nothing(index_elements=[models.Post.id])
+    await session.execute(stmt)
+
+
+async def delete_post(post_id: int, *, session: Optional[AsyncSession] = None) -> bool:
+    session = resolve_session(session)
+    db_model = await _get_db_post(post_id, session=session)
     if db_model is None:
         return False
     await session.delete(db_model)
-    await session.commit()
+    await session.flush()
+    call_after_commit(partial(cache_delete, f"post:{post_id}"), session=session)
     return True
 
 
-async def update_post(session: AsyncSession, post_id: int, schema: schemas.PostUpdate) -> Optional[models.Post]:
-    db_model = await get_post(session, post_id)
-    if db_model is None:
-        return None
-
-    for var, value in vars(schema).items():
-        setattr(db_model, var, value) if value else None
-
-    session.add(db_model)
-    await session.commit()
-    await session.refresh(db_model)
+async def update_post(
+    post_id: int,
+    schema: schemas.PostUpdate,
+    *,
+    session: Optional[AsyncSession] = None,
+) -> Optional[models.Post]:
+    session = resolve_session(session)
+    values = {var: value for var, value in vars(schema).items() if value}
+    if not values:
+        return await _get_db_post(post_id, session=session)
+
+    # Update the post and obtain the updated row within a single UPDATE ... RETURNING query
+    stmt = update(models.Post).where(models.Post.id == post_id).values(**values).returning(models.Post)
+    r = await session.execute(select(models.Post).from_statement(stmt).execution_options(populate_existing=True))
+    db_model = r.scalars().first()
+    call_after_commit(partial(cache_delete, f"post:{post_id}"), session=session)
     return db_model
 
 
-async def get_user_posts(session: AsyncSession, user_id: int) -> list[models.Post]:
-    stmt = select(models.Post).filter(models.Post.user_id == user_id)
-    r = await session.execute(stmt)
-    db_models = r.scalars().fetchall()
-    return db_models
+async def get_user_posts(user_id: int, *, session: Optional[AsyncSession] = None) -> list[models.Post]:
+    session = resolve_session(session)
+    # Users only have a handful of posts, fetching them all at once is a single round-trip,
+    # while streaming them would need a server side cursor, costing extra round-trips
+    stmt = select(models.Post).where(models.Post.user_id == user_id)
+    r = await session.scalars(stmt)
+    return r.all()
 
 
 # endregion
 # region: Member
 
 
-async def make_blank_member(session: AsyncSession) -> models.Member:
+async def make_blank_member(*, session: Optional[AsyncSession] = None) -> models.Member:
+    session = resolve_session(session)
     db_model = models.Member()
     session.add(db_model)
-    await session.commit()
-    await session.refresh(db_model)
+    await session.flush()
     return db_model
 
 
-async def get_member(session: AsyncSession, member_id: int) -> models.Member:
-    stmt = select(models.Member).filter(models.Member.member_id == member_id)
-    r = await session.execute(stmt)
-    db_model = r.scalars().first()
+async def get_member(member_id: int, *, session: Optional[AsyncSession] = None) -> Optional[models.Member]:
+    cached = await cache_get(f"member:{member_id}")
+    if cached is not None:
+        return models.Member(**cached)
+
+    db_model = await _get_db_member(member_id, session=session)
+    if db_model is not None:
+        await cache_set(f"member:{member_id}", _as_dict(db_model), Caching.MODEL_TTL)
     return db_model
 
 
-async def delete_member(session: AsyncSession, member_id: int) -> bool:
-    db_model = await get_member(session, member_id)
+async def _get_db_member(member_id: int, *, session: Optional[AsyncSession] = None) -> Optional[models.Member]:
+    """Obtain the member from the database directly, bypassing the cache (needed when modifying the member)."""
+    session = resolve_session(session)
+    # Primary key lookup, which can be served from the session's identity map without a query
+    return await session.get(models.Member, member_id)
+
+
+async def delete_member(member_id: int, *, session: Optional[AsyncSession] = None) -> bool:
+    session = resolve_session(session)
+    db_model = await _get_db_member(member_id, session=session)
     if db_model is None:
         return False
     await session.delete(db_model)
-    await session.commit()
+    await session.flush()
+    call_after_commit(partial(cache_delete, f"member:{member_id}"), session=session)
     return True
 
 
 async def update_member(
-    session: AsyncSession,
     member_id: int,
     *,
     is_admin: Optional[bool] = None,
     key_salt: Optional[str] = None,
+    session: Optional[AsyncSession] = None,
 ) -> Optional[models.Member]:
-    db_model = await get_member(session, member_id)
-    if db_model is None:
-        return None
-
+    session = resolve_session(session)
+    values: dict[str, Any] = {}
     if is_admin is not None:
-        db_model.is_admin = is_admin
+        values["is_admin"] = is_admin
     if key_salt is not None:
-        db_model.key_salt = key_salt
+        values["key_salt"] = key_salt
+    if not values:
+        return await _get_db_member(member_id, session=session)
 
-    session.add(db_model)
-    await session.commit()
-    await session.refresh(db_model)
+    # Update the member and obtain the updated row within a single UPDATE ... RETURNING query
+    stmt = update(models.Member).where(models.Member.member_id == member_id).values(**values).returning(models.Member)
+    r = await session.execute(select(models.Member).from_statement(stmt).execution_options(populate_existing=True))
+    db_model = r.scalars().first()
+    call_after_commit(partial(cache_delete, f"member:{member_id}"), session=session)
     return db_model
 
 
@@ -1,4 +1,5 @@
 import logging
+from functools import partial
 
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.requests import Request
@@ -6,7 +7,8 @@ from fastapi.responses import Response
 
 from src import crud, models, schemas
 from src.constants import Server
-from src.utils.auth import JWTBearer, generate_member
+from src.utils.auth import JWTBearer, forget_member, generate_member
+from src.utils.database import call_after_commit
 
 log = logging.getLogger(__name__)
 
@@ -26,9 +28,7 @@ async def admin_check(request: Request) -> Response:
 @router.get("/member/{member_id}", response_model=schemas.MemberData)
 async def get_member(request: Request, member_id: int) -> models.Member:
     """Obtain info about member with given `member_id`."""
-    db_session = request.state.db_session
-
-    member = await crud.get_member(db_session, member_id)
+    member = await crud.get_member(member_id)
     if not member:
         raise HTTPException(404, "No such member")
     return member
@@ -37,18 +37,15 @@ async def get_member(request: Request, member_id: int) -> models.Member:
 @router.post("/member")
 async def add_member(request: Request, is_admin: bool) -> schemas.TokenMemberData:
     """Create a new member."""
-    db_session = request.state.db_session
-
-    member = await generate_member(db_session, is_admin=is_admin)
+    member = await generate_member(is_admin=is_admin)
     return member
 
 
 @router.patch("/member/{member_id}", response_model=schemas.MemberData)
 async def update_member(request: Request, member_id: int, is_admin: bool) -> models.Member:
     """Update admin status of a member."""
-    db_session = request.state.db_session
-
-    db_member = await crud.update_member(db_session, member_id, is_admin=is_admin)
+    db_member = await crud.update_member(member_id, is_admin=is_admin)
+    call_after_commit(partial(forget_member, member_id))
     if not db_member:
         raise HTTPException(404, "No such member")
     return db_member
@@ -57,9 +54,8 @@ async def update_member(request: Request, member_id: int, is_admin: bool) -> mod
 @router.delete("/member/{member_id}")
 async def remove_member(request: Request, member_id: int) -> Response:
     """Remove member with given `member_id`."""
-    db_session = request.state.db_session
-
-    status = await crud.delete_member(db_session, member_id)
+    status = await crud.delete_member(member_id)
+    call_after_commit(partial(forget_member, member_id))
     if status is False:
         raise HTTPException(404, "No such member")
     return Response(status_code=200)
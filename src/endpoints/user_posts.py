@@ -1,8 +1,10 @@
+import asyncio
 import logging
+from typing import Any, Union
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from fastapi.requests import Request
-from fastapi.responses import Response
+from fastapi.responses import ORJSONResponse, Response
 
 from src import crud, models, schemas
 from src.constants import Ratelimits
@@ -14,90 +16,99 @@ from src.utils.ratelimits.member_bucket import MemberRedisBucket
 log = logging.getLogger(__name__)
 
 router = APIRouter(tags=["User posts endpoints"])
-member_router = APIRouter(dependencies=[Depends(JWTBearer())])
+# Endpoints requiring authentication, this router is included in the app separately from the public one
+member_router = APIRouter(tags=["User posts endpoints"], dependencies=[Depends(JWTBearer())])
 member_ratelimit_bucket = MemberRedisBucket(
     requests=Ratelimits.REQUESTS_PER_PERIOD,
     time_period=Ratelimits.TIME_PERIOD,
     cooldown=Ratelimits.COOLDOWN_PERIOD,
+    name="member",
 )
 
+# Responses of these endpoints are built directly from the database models, skipping FastAPI's response validation
+# (the models always match the schema), the schema is only referenced for documentation purposes.
+POST_RESPONSES: dict[Union[int, str], dict[str, Any]] = {200: {"model": schemas.Post}}
+POST_LIST_RESPONSES: dict[Union[int, str], dict[str, Any]] = {200: {"model": list[schemas.Post]}}
 
+_USER_ID_ERROR_LOC = ("body", "user_id")
+
+
+def _user_id_error(msg: str) -> HTTPException:
+    """Produce a 422 error for an invalid user_id, following the convention of FastAPI's pydantic validation errors."""
+    return HTTPException(422, {"detail": [{"loc": _USER_ID_ERROR_LOC, "msg": msg, "type": "value_error"}]})
+
+
+def _serialize_post(db_post: models.Post) -> dict:
+    """Convert the post database model into a JSON serializable dict, matching the `schemas.Post` schema."""
+    return {"id": db_post.id, "user_id": db_post.user_id, "title": db_post.title, "body": db_post.body}
+
+
+@member_router.post("/post", response_model=None, responses=POST_RESPONSES)
 @member_ratelimit_bucket
-@member_router.post("/post", response_model=schemas.Post)
-async def create_post(request: Request, data: schemas.PostCreate) -> models.Post:
+async def create_post(request: Request, data: schemas.PostCreate) -> Response:
     """Create a new user post and return the created post."""
     db_session = request.state.db_session
     httpx_client = request.state.httpx_client
+    redis = request.state.redis
 
+    # Validate the user id while the post is being inserted, rather than waiting for the (API) validation
+    # first. The insert is made within a savepoint, so that it's rolled back if the validation fails.
     try:
-        await ensure_valid_user_id(httpx_client, data.user_id)
+        async with db_session.begin_nested():
+            validation = asyncio.create_task(ensure_valid_user_id(httpx_client, redis, data.user_id))
+            try:
+                db_post = await crud.add_post(data)
+            except BaseException:
+                validation.cancel()
+                raise
+            await validation
     except ValueError as exc:
-        # Use the same convention as default FastAPI 422 on pydantic validation error
-        err_details = {
-            "detail": [
-                {
-                    "loc": ["body", "user_id"],
-                    "msg": str(exc),
-                    "type": "value_error",
-                }
-            ]
-        }
-        raise HTTPException(422, err_details)
-
-    db_post = await crud.add_post(db_session, data)
-    return db_post
+        raise _user_id_error(str(exc))
+
+    return ORJSONResponse(_serialize_post(db_post))
 
 
+@router.get("/post/{post_id}", response_model=None, responses=POST_RESPONSES)
 @IPRedisBucket(requests=20, time_period=20, cooldown=50)
-@router.get("/post/{post_id}", response_model=schemas.Post)
-async def get_post(request: Request, post_id: int) -> models.Post:
+async def get_post(request: Request, background_tasks: BackgroundTasks, post_id: int) -> Response:
     """Obtain a post with given `post_id`.
 
     Note: If post with this id is not found in the cache database, this will perform an API lookup.
     """
-    db_session = request.state.db_session
     httpx_client = request.state.httpx_client
+    redis = request.state.redis
 
-    db_post = await lookup_post(db_session, httpx_client, post_id)
+    db_post = await lookup_post(httpx_client, redis, background_tasks, post_id)
     if db_post is None:
         raise HTTPException(404, "No such post")
-    return db_post
+    return ORJSONResponse(_serialize_post(db_post))
 
 
+@member_router.patch("/post/{post_id}", response_model=None, responses=POST_RESPONSES)
 @member_ratelimit_bucket
-@member_router.patch("/post/{post_id}", response_model=schemas.Post)
-async def update_post(request: Request, post_id: int, data: schemas.PostUpdate) -> models.Post:
+async def update_post(request: Request, post_id: int, data: schemas.PostUpdate) -> Response:
     """Update title or body of a post with given `post_id`"""
-    db_session = request.state.db_session
-
-    db_post = await crud.update_post(db_session, post_id, data)
+    db_post = await crud.update_post(post_id, data)
     if not db_post:
         raise HTTPException(404, "No such post")
-    return db_post
+    return ORJSONResponse(_serialize_post(db_post))
 
 
-@member_ratelimit_bucket
 @member_router.delete("/post/{post_id}")
+@member_ratelimit_bucket
 async def delete_post(request: Request, post_id: int) -> Response:
     """Delete post with given `post_id` from the database."""
-    db_session = request.state.db_session
-
-    status = await crud.delete_post(db_session, post_id)
+    status = await crud.delete_post(post_id)
     if status is False:
         raise HTTPException(404, "No such post")
     return Response(status_code=200)
 
 
-@router.get("/posts/{user_id}", response_model=list[schemas.Post])
-async def get_posts(request: Request, user_id: int) -> list[models.Post]:
+@router.get("/posts/{user_id}", response_model=None, responses=POST_LIST_RESPONSES)
+async def get_posts(request: Request, user_id: int) -> Response:
     """Obtain a list of all posts with given `user_id`.
 
     Note: This only obtains posts from the cached database, it does not perform an API lookup.
     """
-    db_session = request.state.db_session
-
-    db_posts = await crud.get_user_posts(db_session, user_id)
-    return db_posts
-
-
-router.include_router(member_router)
+    posts = [_serialize_post(db_post) for db_post in await crud.get_user_posts(user_id)]
+    return ORJSONResponse(posts)
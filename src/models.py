@@ -10,7 +10,7 @@ class Post(Base):
     __tablename__ = "posts"
 
     id: int = Column(Integer, primary_key=True, index=True)
-    user_id: int = Column(Integer)
+    user_id: int = Column(Integer, index=True)
     title: str = Column(String)
     body: str = Column(String)
 
@@ -1,7 +1,14 @@
+import base64
+import hashlib
+import hmac
 import secrets
 from enum import Enum
+from functools import lru_cache, partial
+from time import time
 from typing import Optional, TypedDict, cast
 
+import orjson
+from cachetools import TTLCache
 from fastapi import HTTPException, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import JWTError, jwt
@@ -10,6 +17,13 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from src import crud, schemas
 from src.constants import Server
 from src.models import Member
+from src.utils.database import call_after_commit
+
+# Members recently looked up for token validation, keyed by member id. This keeps the (database/redis)
+# member lookup out of the path of most authenticated requests, as long as the member doesn't change.
+# Note that the cache is per process, invalidation only affects the current worker, other workers will
+# pick up the changes once the (short) TTL runs out.
+_member_cache: TTLCache[int, Member] = TTLCache(maxsize=10_000, ttl=15)
 
 
 class TokenData(TypedDict):
@@ -30,8 +44,29 @@ class AuthState(Enum):
     NEEDS_ADMIN = "This endpoint is limited to admins."
 
 
+@lru_cache(maxsize=8192)
+def _decode_token(token: str, secret: str) -> TokenData:
+    """
+    Decode and verify given JWT token, caching the results for tokens which were already seen.
+
+    Only successfully decoded tokens are cached (exceptions aren't), and since the cache is keyed
+    on the token itself, a token which was tampered with will never hit the cache.
+    """
+    return cast(TokenData, jwt.decode(token, secret))
+
+
+def _decode_jwt(token: str) -> TokenData:
+    """Decode and verify given JWT token, raising JWTError if it's not valid (or has expired)."""
+    token_data = _decode_token(token, Server.JWT_SECRET)
+
+    # Expiration is only verified when the token is first decoded, make sure cached tokens can't outlive it
+    if "exp" in token_data and token_data["exp"] <= time():  # type: ignore # exp isn't a part of our tokens
+        raise JWTError("Signature has expired.")
+
+    return token_data
+
+
 async def validate_token(
-    db_session: AsyncSession,
     token: Optional[str],
     *,
     needs_admin: bool = False,
@@ -45,12 +80,12 @@ async def validate_token(
         raise HTTPException(403, AuthState.NO_TOKEN.value)
 
     try:
-        token_data = cast(TokenData, jwt.decode(token, Server.JWT_SECRET))
+        token_data = _decode_jwt(token)
     except JWTError:
         raise HTTPException(403, AuthState.INVALID_TOKEN.value)
 
-    member = await crud.get_member(db_session, int(token_data["id"]))
-    if member is None or member.ket_salt != token_data["salt"]:
+    member = await _get_member(int(token_data["id"]))
+    if member is None or member.key_salt != token_data["salt"]:
         raise HTTPException(403, AuthState.INVALID_TOKEN.value)
 
     if needs_admin and not member.is_admin:
@@ -59,6 +94,27 @@ async def validate_token(
     return token_data, member
 
 
+async def _get_member(member_id: int) -> Optional[Member]:
+    """Obtain the member for token validation, going through the in-process member cache."""
+    member = _member_cache.get(member_id)
+    if member is not None:
+        return member
+
+    db_member = await crud.get_member(member_id)
+    if db_member is None:
+        return None
+
+    # Store a detached copy, so that the cached member isn't tied to (and modified through) this request's session
+    member = Member(member_id=db_member.member_id, is_admin=db_member.is_admin, key_salt=db_member.key_salt)
+    _member_cache[member_id] = member
+    return member
+
+
+def forget_member(member_id: int) -> None:
+    """Remove given member from the in-process member cache, this should be called whenever a member is modified."""
+    _member_cache.pop(member_id, None)
+
+
 class JWTBearer(HTTPBearer):
     """Dependency for routes to enforce JWT auth."""
 
@@ -70,8 +126,7 @@ class JWTBearer(HTTPBearer):
         """Check if the supplied credentials are valid for this endpoint."""
         credentials = cast(HTTPAuthorizationCredentials, await super().__call__(request))
         jwt_token = credentials.credentials
-        db_session = request.state.db_session
-        _, member = await validate_token(db_session, jwt_token, needs_admin=self.require_admin)
+        _, member = await validate_token(jwt_token, needs_admin=self.require_admin)
 
         # Token is valid, store the member_id and is_admin data into the request
         request.state.member_id = member.member_id
@@ -80,6 +135,15 @@ class JWTBearer(HTTPBearer):
         return credentials
 
 
+def _b64encode(data: bytes) -> bytes:
+    """Encode given data with the unpadded URL-safe base64 encoding, as used by JWT."""
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+# The header of our tokens never changes, so it only needs to be encoded once
+_JWT_HEADER_B64 = _b64encode(b'{"alg":"HS256","typ":"JWT"}')
+
+
 def _make_member_token(member_id: int) -> tuple[str, str]:
     """
     Generate a JWT token for given member_id.
@@ -89,20 +153,32 @@ def _make_member_token(member_id: int) -> tuple[str, str]:
     # 22 characters long string
     token_salt = secrets.token_urlsafe(16)
     token_data = {"id": member_id, "salt": token_salt}
-    token = jwt.encode(token_data, Server.JWT_SECRET, algorithm="HS256")
+
+    # Assemble the (HS256 signed) JWT token manually, reusing the pre-encoded header
+    signing_input = _JWT_HEADER_B64 + b"." + _b64encode(orjson.dumps(token_data))
+    signature = hmac.new(Server.JWT_SECRET.encode(), signing_input, hashlib.sha256).digest()
+    token = (signing_input + b"." + _b64encode(signature)).decode()
     return token, token_salt
 
 
-async def reset_member(db_session: AsyncSession, member_id: int, *, is_admin: bool = False) -> schemas.TokenMemberData:
+async def reset_member(
+    member_id: int,
+    *,
+    is_admin: bool = False,
+    session: Optional[AsyncSession] = None,
+) -> schemas.TokenMemberData:
     """Generate a new API token for given member and update the member data to match."""
     token, token_salt = _make_member_token(member_id)
-    await crud.update_member(db_session, member_id, is_admin=is_admin, key_salt=token_salt)
+    await crud.update_member(member_id, is_admin=is_admin, key_salt=token_salt, session=session)
+    call_after_commit(partial(forget_member, member_id), session=session)
     ret = schemas.TokenMemberData(member_id=member_id, api_token=token, is_admin=is_admin)
     return ret
 
 
-async def generate_member(db_session: AsyncSession, *, is_admin: bool = False) -> schemas.TokenMemberData:
+async def generate_member(
+    *, is_admin: bool = False, session: Optional[AsyncSession] = None
+) -> schemas.TokenMemberData:
     """Generate and store a new member, returning their API token and member id."""
-    new_member = await crud.make_blank_member(db_session)
-    member_data = await reset_member(db_session, new_member.member_id, is_admin=is_admin)
+    new_member = await crud.make_blank_member(session=session)
+    member_data = await reset_member(new_member.member_id, is_admin=is_admin, session=session)
     return member_data
@@ -0,0 +1,44 @@
+from contextvars import ContextVar
+from typing import Any, Optional
+
+import orjson
+from aioredis import Redis
+
+# Redis client bound to the currently handled request, set by the session middleware. This allows
+# deeper layers (such as CRUD) to use the cache, without having to pass the client through every call.
+_request_redis: ContextVar[Redis] = ContextVar("_request_redis")
+
+
+def get_request_redis() -> Optional[Redis]:
+    """Obtain the redis client bound to the currently handled request, or None if there isn't any."""
+    return _request_redis.get(None)
+
+
+async def cache_get(key: str) -> Optional[dict[str, Any]]:
+    """Obtain cached data stored under given key, or None if it isn't cached (or caching isn't available)."""
+    redis = get_request_redis()
+    if redis is None:
+        return None
+
+    raw = await redis.get(key)
+    if raw is None:
+        return None
+    return orjson.loads(raw)
+
+
+async def cache_set(key: str, data: dict[str, Any], ttl: int) -> None:
+    """Cache given data under given key, for `ttl` seconds."""
+    redis = get_request_redis()
+    if redis is None:
+        return
+
+    await redis.setex(key, ttl, orjson.dumps(data))
+
+
+async def cache_delete(key: str) -> None:
+    """Invalidate cached data stored under given key."""
+    redis = get_request_redis()
+    if redis is None:
+        return
+
+    await redis.delete(key)
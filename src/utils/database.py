@@ -1,15 +1,83 @@
+import inspect
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from src.constants import Connection
 
+# Keep more of the prepared statements cached per connection than asyncpg's default of 100,
+# so that our queries don't need to get re-prepared on the database server
+_database_url = make_url(f"postgresql+asyncpg://{Connection.DATABASE_URL}").update_query_dict(
+    {"prepared_statement_cache_size": str(Connection.DB_STATEMENT_CACHE_SIZE)}
+)
+
 # Disable JIT for PostgreSQL database, to improve ENUM datatype handling, for more info, see:
 # https://docs.sqlalchemy.org/en/14/dialects/postgresql.html#disabling-the-postgresql-jit-to-improve-enum-datatype-handling
+# Note that the pool is per process, when running multiple (uvicorn) workers, each one of them
+# can open up to DB_POOL_SIZE + DB_MAX_OVERFLOW connections.
 engine = create_async_engine(
-    f"postgresql+asyncpg://{Connection.DATABASE_URL}",
+    _database_url,
     connect_args={"server_settings": {"jit": "off"}},
+    pool_size=Connection.DB_POOL_SIZE,
+    max_overflow=Connection.DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    query_cache_size=1200,
 )
 
 Base = declarative_base()
-SessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+# Explicitly typed, so that the created sessions are known to be async sessions (sessionmaker isn't generic in 1.4)
+SessionLocal: Callable[[], AsyncSession] = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+# Session bound to the currently handled request, set by the session middleware. This allows
+# helpers deeper in the call stack to reuse it, without having to pass it through every call.
+_request_session: ContextVar[AsyncSession] = ContextVar("_request_session")
+
+
+def get_request_session() -> AsyncSession:
+    """Obtain the database session bound to the currently handled request."""
+    return _request_session.get()
+
+
+def resolve_session(session: Optional[AsyncSession] = None) -> AsyncSession:
+    """Fall back to the session of the currently handled request if no session was passed explicitly."""
+    if session is None:
+        return get_request_session()
+    return session
+
+
+def call_after_commit(
+    callback: Callable[[], Optional[Awaitable[None]]],
+    *,
+    session: Optional[AsyncSession] = None,
+) -> None:
+    """
+    Call given (sync or async) callback once the changes made within given session are committed.
+
+    By default, the session of the currently handled request is used.
+
+    This is needed for invalidating cached data, invalidating it before the commit would allow concurrent
+    requests to cache the old data again, before the changes become visible to them. For request sessions,
+    the callbacks are ran by the session middleware, if the transaction is rolled back (on unhandled exceptions
+    and error responses), they're dropped.
+    """
+    resolve_session(session).info.setdefault("after_commit", []).append(callback)
+
+
+async def run_after_commit(session: AsyncSession) -> None:
+    """Run (and forget) all of the callbacks waiting for the changes made within given session to be committed."""
+    callbacks = session.info.pop("after_commit", [])
+    for callback in callbacks:
+        result = callback()
+        if inspect.isawaitable(result):
+            await result
+
+
+def discard_after_commit(session: AsyncSession) -> None:
+    """Forget all of the callbacks waiting for the changes made within given session, as they were rolled back."""
+    session.info.pop("after_commit", None)
@@ -1,69 +1,163 @@
+import asyncio
 import logging
 from typing import Optional
 
 import httpx
-from sqlalchemy.ext.asyncio import AsyncSession as DBAsyncSession
+import orjson
+from aioredis import Redis
+from fastapi import BackgroundTasks
 
 from src import crud, models, schemas
-from src.constants import Connection
+from src.constants import Caching
+from src.utils.database import SessionLocal
 
 log = logging.getLogger(__name__)
 
+# API lookups of posts which are currently in progress, keyed by the post id. Concurrent
+# lookups of the same post wait for the already running lookup instead of making another
+# API request. The lookup is cancelled once there's nobody waiting for it anymore.
+_inflight_lookups: dict[int, asyncio.Task[Optional[schemas.Post]]] = {}
+_inflight_waiters: dict[int, int] = {}
 
-async def ensure_valid_user_id(httpx_client: httpx.AsyncClient, user_id: int) -> None:
+
+async def user_exists(httpx_client: httpx.AsyncClient, redis: Redis, user_id: int) -> bool:
+    """
+    Check whether a user with given user_id exists using external API.
+
+    The result of this check is cached in redis, so that repeated checks for the same user
+    (e.g. when a user is creating multiple posts) don't need to make the API request again.
+    """
+    cache_key = f"user_exists:{user_id}"
+    cached = await redis.get(cache_key)
+    if cached is not None:
+        log.debug("Validity for user_id=%d obtained from cache", user_id)
+        return cached == "1"
+
+    response = await httpx_client.get(f"/users/{user_id}")
+    if response.status_code not in (200, 404):
+        # Make sure we exit loudly with HTTPError from httpx in case the API fails
+        # this should produce HTTP code 500 when unhandled within route
+        response.raise_for_status()
+
+    exists = response.status_code == 200
+    await redis.set(cache_key, "1" if exists else "0", ex=Caching.USER_EXISTS_TTL)
+    return exists
+
+
+async def ensure_valid_user_id(httpx_client: httpx.AsyncClient, redis: Redis, user_id: int) -> None:
     """
     Custom validation logic for user_id using external API.
 
     We do this here instead of in the Post model schema because we're making an asynchronous
     request and pydantic doesn't support async validators.
     """
-    log.debug(f"Checking validity of {user_id=}")
-    response = await httpx_client.get(f"{Connection.API_BASE_URL}/users/{user_id}")
-    if response.status_code == 200:
-        log.debug(f"Validity for {user_id=} confirmed")
+    log.debug("Checking validity of user_id=%d", user_id)
+    if await user_exists(httpx_client, redis, user_id):
+        log.debug("Validity for user_id=%d confirmed", user_id)
         return
-    if response.status_code != 404:
-        # Make sure we exit loudly with HTTPError from httpx in case the API fails
-        # this should produce HTTP code 500 when unhandled within route
-        response.raise_for_status()
 
-    log.debug(f"Validity for {user_id=} failed, no such user.")
+    log.debug("Validity for user_id=%d failed, no such user.", user_id)
     raise ValueError(f"User with {user_id=} doesn't exist.")
 
 
 async def lookup_post(
-    db_session: DBAsyncSession,
     httpx_client: httpx.AsyncClient,
+    redis: Redis,
+    background_tasks: BackgroundTasks,
     post_id: int,
 ) -> Optional[models.Post]:
     """
     Find post of given id in our database, or if it's not present, look it up from API.
 
     If the post isn't present, the lookup will also store the post into our database for faster future lookups.
-    If the post lookup fails (both from database and API), return None.
+    This is done in a background task, which only runs once the response was sent.
+    If the post lookup fails (both from database and API), return None, remembering that the post doesn't exist
+    for a short while, so that repeated lookups of it don't need to go through the database or API again.
     """
-    log.debug(f"Looking up post {post_id}")
-    db_post = await crud.get_post(db_session, post_id)
+    log.debug("Looking up post %d", post_id)
+    negcache_key = f"negcache:post:{post_id}"
+    if await redis.exists(negcache_key):
+        log.debug("Post %d is known not to exist (negative cache)", post_id)
+        return None
+
+    db_post = await crud.get_post(post_id)
     if db_post is not None:
-        log.debug(f"Post {post_id} found from database")
+        log.debug("Post %d found from database", post_id)
         return db_post
 
-    log.debug(f"Post {post_id} not present in database, falling back to API lookup")
-    response = await httpx_client.get(f"{Connection.API_BASE_URL}/posts/{post_id}")
+    log.debug("Post %d not present in database, falling back to API lookup", post_id)
+    post_schema = await _lookup_api_post(httpx_client, post_id)
+    if post_schema is None:
+        # NX: don't prolong the TTL if a concurrent lookup already marked the post as missing
+        await redis.set(negcache_key, 1, ex=Caching.NEGATIVE_TTL, nx=True)
+        return None
+
+    log.debug("Obtained post %d from the API, scheduling it to be stored into the database", post_id)
+    background_tasks.add_task(_store_post, post_schema)
+    return models.Post(**post_schema.dict())
+
+
+async def _store_post(post_schema: schemas.Post) -> None:
+    """
+    Store the post obtained from the API into the database, in its own session and transaction.
+
+    This runs after the response was already sent, failing here only means that the post will be
+    looked up from the API again next time, so the errors are only logged.
+    """
+    try:
+        async with SessionLocal() as db_session, db_session.begin():
+            await crud.store_post(post_schema, session=db_session)
+    except Exception:
+        log.exception("Failed to store post %d obtained from the API", post_schema.id)
+
+
+async def _lookup_api_post(httpx_client: httpx.AsyncClient, post_id: int) -> Optional[schemas.Post]:
+    """
+    Look up given post from the API, or join an already running lookup of the same post.
+
+    The (potentially shared) lookup is shielded from the cancellation of a single waiter, it's only
+    cancelled once the last of the waiters leaves without waiting for the result.
+    """
+    task = _inflight_lookups.get(post_id)
+    if task is None:
+        task = asyncio.create_task(_fetch_post(httpx_client, post_id))
+        _inflight_lookups[post_id] = task
+        task.add_done_callback(lambda done_task: _forget_lookup(post_id, done_task))
+
+    _inflight_waiters[post_id] = _inflight_waiters.get(post_id, 0) + 1
+    try:
+        return await asyncio.shield(task)
+    finally:
+        _inflight_waiters[post_id] -= 1
+        if _inflight_waiters[post_id] == 0:
+            del _inflight_waiters[post_id]
+            if not task.done():
+                log.debug("Cancelling API lookup of post %d, nobody is waiting for it anymore", post_id)
+                # Forget the lookup right away, later lookups need to start a new one, not join the cancelled one
+                _forget_lookup(post_id, task)
+                task.cancel()
+
+
+def _forget_lookup(post_id: int, task: asyncio.Task[Optional[schemas.Post]]) -> None:
+    """Remove given lookup from the in-flight lookups, unless it was already replaced by a newer one."""
+    if _inflight_lookups.get(post_id) is task:
+        del _inflight_lookups[post_id]
+
+
+async def _fetch_post(httpx_client: httpx.AsyncClient, post_id: int) -> Optional[schemas.Post]:
+    """Look up the post from the API, returning None if it doesn't exist."""
+    response = await httpx_client.get(f"/posts/{post_id}")
     if response.status_code == 404:
-        log.debug(f"Post {post_id} not present on API.")
+        log.debug("Post %d not present on API.", post_id)
         return None
     # Make sure we exit loudly with HTTPError from httpx in case the API fails
     # this should produce HTTP code 500 when unhandled within route
     response.raise_for_status()
 
-    post_data = response.json()
-    post_schema = schemas.Post(
+    post_data = orjson.loads(response.content)
+    return schemas.Post(
         id=post_data["id"],
         user_id=post_data["userId"],
         title=post_data["title"],
         body=post_data["body"],
     )
-    log.debug(f"Obtained post {post_id} from the API, storing it into the database")
-    db_post = await crud.add_post(db_session, post_schema)
-    return db_post
@@ -1,20 +1,29 @@
+import inspect
 import itertools
 import logging
-import uuid
+import math
+import os
+import zlib
 from abc import ABC, abstractmethod
-from collections.abc import Awaitable, Callable
-from functools import wraps
-from time import time
-from typing import Generic, ParamSpec, TypeVar, cast
+from collections.abc import Awaitable, Callable, Hashable
+from functools import lru_cache, wraps
+from time import monotonic_ns
+from typing import Generic, Optional, ParamSpec, TypeVar, Union, cast
 
 from aioredis import Redis
+from aioredis.client import Script
+from aioredis.exceptions import RedisError
+from cachetools import TTLCache
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import ORJSONResponse, Response
 
 P = ParamSpec("P")
 T = TypeVar("T")
 log = logging.getLogger(__name__)
 
+# Random token generated once on import, making interaction ids of different machines distinct
+_HOST_TOKEN = os.urandom(4).hex()
+
 
 class OnCooldownError(Exception):
     """An exception class to provide information on the current cooldown."""
@@ -27,14 +36,22 @@ class OnCooldownError(Exception):
 class BucketBase(ABC, Generic[T]):
     """The base class for all rate limit buckets."""
 
+    # Buckets only ever hold these attributes, avoid having a __dict__ for every bucket instance
+    __slots__ = ("requests", "time_period", "cooldown", "name", "bucket_no", "_static_headers")
+
     _bucket_counter = itertools.count(0)
 
+    # Errors of the bucket's backend, on which the requests are allowed (fail-open) rather than failing
+    # the request, so that an outage of the backend storing the ratelimits doesn't take down the whole API.
+    fail_open_errors: tuple[type[Exception], ...] = ()
+
     def __init__(
         self,
         *,
         requests: int,
         time_period: float,
         cooldown: float,
+        name: Optional[str] = None,
     ):
         """
         Bucket constructor. Limits are enforced as `requests` per `time_period`.
@@ -42,6 +59,8 @@ class BucketBase(ABC, Generic[T]):
         :param requests: The maximum allowed requests for this bucket per `time_unit`.
         :param time_period: The time period for requests in seconds.
         :param cooldown: The penalty cooldown in seconds for surpassing the allowed request limit.
+        :param name: A unique name of this bucket, used to derive the bucket number. If not provided, the
+            bucket gets named after the first route function it decorates.
         """
         self.requests = requests
         self.time_period = time_period
@@ -49,24 +68,49 @@ class BucketBase(ABC, Generic[T]):
 
         # Assign each instance a different bucket number so that we can distinguish
         # between the bucket instances when storing/accessing data into/from a database.
-        self.bucket_no = next(self._bucket_counter)
+        # Numbers derived from the names are the same across restarts (and reloads), unlike
+        # the counter, which is only used for buckets which never get a name.
+        self.name = name
+        self.bucket_no = self._name_bucket_no(name) if name is not None else next(self._bucket_counter)
+
+        # The limit headers never change for the bucket, keep them already encoded
+        self._static_headers = [
+            (b"requests-limit", str(self.requests).encode("latin-1")),
+            (b"requests-period", str(self.time_period).encode("latin-1")),
+        ]
+
+    @staticmethod
+    def _name_bucket_no(name: str) -> int:
+        """Derive a (stable) bucket number from the name of a bucket."""
+        return zlib.crc32(name.encode()) & 0xFFFF
+
+    async def handle_request(self, bucket_key: T) -> tuple[int, int]:
+        """
+        Logic occcuring on a new call to bucket rate limited route.
 
-    async def handle_request(self, bucket_key: T) -> None:
-        """Logic occcuring on a new call to bucket rate limited route."""
-        log.debug(f"Handling rate-limited route for bucket key {bucket_key} (bucket #{self.bucket_no})")
+        Returns the remaining requests and the time until they're reset (in seconds) after the request was
+        recorded, for the ratelimit informing headers. Raises OnCooldownError if the request isn't allowed.
+        """
+        log.debug("Handling rate-limited route for bucket key %s (bucket #%d)", bucket_key, self.bucket_no)
         cooldown_remaining = await self.get_cooldown(bucket_key)
         if cooldown_remaining > 0:
             log.debug(
-                f"Request attempt for bucket key {bucket_key}, which is currently under cooldown, made."
-                f" Interaction prevented, {cooldown_remaining} seconds of cooldown remaining (bucket #{self.bucket_no})"
+                "Request attempt for bucket key %s, which is currently under cooldown, made."
+                " Interaction prevented, %d seconds of cooldown remaining (bucket #%d)",
+                bucket_key,
+                cooldown_remaining,
+                self.bucket_no,
             )
             raise OnCooldownError(cooldown_remaining)
 
         remaining_requests = await self.get_remaining_requests(bucket_key)
         if remaining_requests <= 0:
             log.debug(
-                f"Request attempt for bucket key {bucket_key} with {remaining_requests} remaining requests made."
-                f" Interaction NOT within ratelimit, trigering cooldown (bucket #{self.bucket_no})"
+                "Request attempt for bucket key %s with %d remaining requests made."
+                " Interaction NOT within ratelimit, trigering cooldown (bucket #%d)",
+                bucket_key,
+                remaining_requests,
+                self.bucket_no,
             )
             # Attempted to make another request, with no remaining requests, trigger the penalty cooldown
             await self.start_cooldown(bucket_key)
@@ -74,44 +118,64 @@ class BucketBase(ABC, Generic[T]):
             raise OnCooldownError(cooldown_remaining)
 
         log.debug(
-            f"Request attempt for bucket key {bucket_key} with {remaining_requests} remaining requests made."
-            f" Interaction is within ratelimit, recording the attempt (bucket #{self.bucket_no})"
+            "Request attempt for bucket key %s with %d remaining requests made."
+            " Interaction is within ratelimit, recording the attempt (bucket #%d)",
+            bucket_key,
+            remaining_requests,
+            self.bucket_no,
         )
         await self.record_interaction(bucket_key)
+        return remaining_requests - 1, await self.get_reset_time(bucket_key)
 
     def __call__(self, func: Callable[P, Awaitable[Response]]) -> Callable[P, Awaitable[Response]]:
         """Decorate route function returning a custom caller enforcing bucket rate limits."""
+        # FastAPI always passes the route parameters as keyword arguments, it's therefore enough to check
+        # for the request parameter once here, rather than checking the kwargs on every request.
+        if "request" not in inspect.signature(func).parameters:
+            raise AttributeError("Bucket limiting requires the route function to have a 'request' attribute.")
+
+        # A bucket shared by multiple routes keeps the name (and so the bucket number) from the first one
+        if self.name is None:
+            self.name = f"{type(self).__name__}:{func.__module__}.{func.__qualname__}"
+            self.bucket_no = self._name_bucket_no(self.name)
 
         @wraps(func)
         async def caller(*args: P.args, **kwargs: P.kwargs) -> Response:
-            if "request" not in kwargs:
-                raise AttributeError("Bucket limiting requires the route function to have a 'request' attribute.")
-
             request = cast(Request, kwargs["request"])
             await self.pre_call(request)
             bucket_key = await self.get_bucket_key(request)
 
             try:
-                await self.handle_request(bucket_key)
+                remaining_requests, time_until_reset = await self.handle_request(bucket_key)
             except OnCooldownError as exc:
-                response = JSONResponse({"message": "You're currently on cooldown. Try again later."}, 429)
+                response = ORJSONResponse({"message": "You're currently on cooldown. Try again later."}, 429)
                 await self.add_cooldown_headers(response, exc.remaining)
-            else:
-                response = await func(*args, **kwargs)
-                await self.add_headers(response, bucket_key)
+                return response
+            except self.fail_open_errors:
+                log.warning(
+                    "Unable to check the ratelimit for bucket key %s, allowing the request (bucket #%d)",
+                    bucket_key,
+                    self.bucket_no,
+                    exc_info=True,
+                )
+                return await func(*args, **kwargs)
+
+            response = await func(*args, **kwargs)
+            await self.add_headers(response, remaining_requests, time_until_reset)
             return response
 
         return caller
 
-    async def add_headers(self, response: Response, bucket_key: T) -> None:
-        """Add ratelimit informing headers to provided response."""
-        remaining_interactions = await self.get_remaining_requests(bucket_key)
-        time_until_reset = await self.get_reset_time(bucket_key)
+    async def add_headers(self, response: Response, remaining_interactions: int, time_until_reset: int) -> None:
+        """
+        Add ratelimit informing headers with given values (as obtained by `handle_request`) to provided response.
 
-        response.headers.append("Requests-Limit", str(self.requests))
-        response.headers.append("Requests-Period", str(self.time_period))
-        response.headers.append("Requests-Reminding", str(remaining_interactions))
-        response.headers.append("Requests-Reset", str(time_until_reset))
+        The headers are appended to the raw (already encoded) response headers directly, with the
+        static ones (not depending on the request) being pre-encoded when the bucket is created.
+        """
+        response.raw_headers.extend(self._static_headers)
+        response.raw_headers.append((b"requests-reminding", str(remaining_interactions).encode("latin-1")))
+        response.raw_headers.append((b"requests-reset", str(time_until_reset).encode("latin-1")))
 
     async def add_cooldown_headers(self, response: Response, remaining_seconds: int) -> None:
         """
@@ -122,11 +186,11 @@ class BucketBase(ABC, Generic[T]):
         want the cooldown header(s). This can however be overridden to call add_headers along
         with this original implementation if having regular headers too is desired.
         """
-        response.headers.append("Cooldown-Reset", str(remaining_seconds))
+        response.raw_headers.append((b"cooldown-reset", str(remaining_seconds).encode("latin-1")))
 
     async def pre_call(self, request: Request) -> None:
         """A hook function called before handling each request to a rate-limited route."""
-        log.debug(f"Someone accessed rate-limited route (pre-call) (bucket #{self.bucket_no})")
+        log.debug("Someone accessed rate-limited route (pre-call) (bucket #%d)", self.bucket_no)
 
     @abstractmethod
     async def get_bucket_key(self, request: Request) -> T:
@@ -180,64 +244,478 @@ class BucketBase(ABC, Generic[T]):
         raise NotImplementedError()
 
 
+# Atomically check the cooldown and the counter of interactions in the current (fixed) time window
+# of a bucket, recording the interaction, or starting the cooldown. The window starts with the first
+# interaction, and ends once the counter expires.
+# KEYS: window counter key, cooldown key; ARGV: requests, time period, cooldown
+# Returns {allowed (0/1), milliseconds of cooldown remaining, remaining requests, milliseconds until reset}.
+FIXED_WINDOW_SCRIPT = """
+local window_key = KEYS[1]
+local cooldown_key = KEYS[2]
+local requests = tonumber(ARGV[1])
+local time_period = math.ceil(tonumber(ARGV[2]) * 1000)
+local cooldown = math.ceil(tonumber(ARGV[3]) * 1000)
+
+local cooldown_remaining = redis.call('PTTL', cooldown_key)
+if cooldown_remaining > 0 then
+    return {0, cooldown_remaining, 0, 0}
+end
+
+local interactions = tonumber(redis.call('GET', window_key) or '0')
+if interactions >= requests then
+    redis.call('SET', cooldown_key, 1, 'PX', cooldown)
+    return {0, cooldown, 0, 0}
+end
+
+interactions = redis.call('INCR', window_key)
+if interactions == 1 then
+    redis.call('PEXPIRE', window_key, time_period)
+    return {1, 0, requests - interactions, time_period}
+end
+return {1, 0, requests - interactions, redis.call('PTTL', window_key)}
+"""
+
+# Atomically check the cooldown and the sliding window of interactions (a sorted set of unique members
+# scored by the time they expire at) of a bucket, recording the interaction, or starting the cooldown.
+# KEYS: interaction key, cooldown key; ARGV: time period, requests, cooldown, interaction member
+# Returns {allowed (0/1), milliseconds of cooldown remaining, remaining requests, milliseconds until reset}.
+SLIDING_WINDOW_SCRIPT = """
+redis.replicate_commands()
+local interaction_key = KEYS[1]
+local cooldown_key = KEYS[2]
+local time_period = tonumber(ARGV[1])
+local requests = tonumber(ARGV[2])
+local cooldown = tonumber(ARGV[3])
+
+local server_time = redis.call('TIME')
+local now = tonumber(server_time[1]) + tonumber(server_time[2]) / 1000000
+
+local cooldown_remaining = redis.call('PTTL', cooldown_key)
+if cooldown_remaining > 0 then
+    return {0, cooldown_remaining, 0, 0}
+end
+
+redis.call('ZREMRANGEBYSCORE', interaction_key, 0, now)
+local remaining = requests - redis.call('ZCARD', interaction_key)
+if remaining <= 0 then
+    redis.call('SET', cooldown_key, 1, 'PX', math.ceil(cooldown * 1000))
+    return {0, math.ceil(cooldown * 1000), 0, 0}
+end
+
+-- The new interaction is the newest one, the interactions are fully reset once it expires
+redis.call('ZADD', interaction_key, now + time_period, ARGV[4])
+redis.call('PEXPIRE', interaction_key, math.ceil(time_period * 1000))
+return {1, 0, remaining - 1, math.ceil(time_period * 1000)}
+"""
+
+
+@lru_cache(maxsize=65536)
+def _make_redis_key(bucket_no: int, bucket_key: Hashable, name: str) -> str:
+    """
+    Produce the redis key of given bucket, bucket_key and name.
+
+    The same keys are needed over and over (for every request of the same client), so they're cached,
+    rather than being formatted again each time.
+    """
+    return f"bucket-{bucket_no}-{bucket_key}-{name}"
+
+
 class RedisBucketBase(BucketBase[T]):
-    """The base class for all rate-limit buckets backed by Redis."""
+    """
+    The base class for all rate-limit buckets backed by Redis.
+
+    By default, requests are counted in fixed time windows (a single counter per bucket key, which
+    resets `time_period` after the first request). This is very cheap, but it does allow bursts of up to
+    twice the limit around the window boundaries. For exact rolling windows, use `SlidingWindowRedisBucketBase`.
+
+    Time is always taken from the redis server (in the Lua scripts, or from the key expiry), so that
+    the limits don't depend on the clocks of the (potentially many) API machines being in sync.
+    """
 
-    redis: Redis = None  # type: ignore # This will always get set in pre_call
+    __slots__ = ("redis", "_script", "_indexed")
+
+    fail_open_errors = (RedisError,)
+
+    # The Lua script performing the whole check of a request in `handle_request`
+    lua_script: str = FIXED_WINDOW_SCRIPT
+
+    def __init__(
+        self,
+        *,
+        requests: int,
+        time_period: float,
+        cooldown: float,
+        name: Optional[str] = None,
+        redis: Optional[Redis] = None,
+    ):
+        """
+        Redis bucket constructor, see `BucketBase` for the limit parameters.
+
+        :param redis: The redis client to use for this bucket. If not provided, the application's shared
+            (connection pool backed) client is taken from the state of the first handled request.
+        """
+        super().__init__(requests=requests, time_period=time_period, cooldown=cooldown, name=name)
+        self.redis: Redis = redis  # type: ignore # If None, this will always get set in pre_call
+        self._script: Optional[Script] = None  # Registered with the redis client on first use
+        self._indexed = False  # Whether this bucket was already stored into the buckets index
 
     def get_redis_key(self, bucket_key: T, name: str) -> str:
         """Get a redis key unique to this bucket and bucket_key for given name."""
-        return f"bucket-{self.bucket_no}-{bucket_key}-{name}"
+        return _make_redis_key(self.bucket_no, bucket_key, name)
 
     async def pre_call(self, request: Request) -> None:
-        """Get redis pool from the request state data before handling a request to rate-limited route."""
+        """Get redis client from the request state data before handling a request to rate-limited route."""
         await super().pre_call(request)
         if self.redis is None:
-            self.redis = request.state.redis_pool
+            self.redis = request.state.redis
 
-    async def get_remaining_requests(self, bucket_key: T) -> int:
-        redis_key = self.get_redis_key(bucket_key, "interaction")
+        if not self._indexed:
+            # Keep the names of the buckets (by their numbers) in redis, to make the bucket keys identifiable
+            try:
+                await self.redis.hset("buckets:index", str(self.bucket_no), self.name or "")
+            except RedisError:
+                log.warning("Unable to store bucket #%d into the buckets index", self.bucket_no, exc_info=True)
+            else:
+                self._indexed = True
+
+    async def get_server_time(self) -> float:
+        """Get the current (UNIX) time of the redis server, in seconds."""
+        seconds, microseconds = await self.redis.time()
+        return seconds + microseconds / 1_000_000
+
+    async def run_script(self, keys: list[str], args: list[Union[str, int, float]]) -> list[int]:
+        """
+        Run the bucket's Lua script with given keys and arguments.
+
+        The script is called by its SHA (EVALSHA), only being loaded to redis if it doesn't know it yet.
+        """
+        if self._script is None:
+            self._script = self.redis.register_script(self.lua_script)
+        return await self._script(keys=keys, args=args)
+
+    def get_script_params(self, bucket_key: T) -> tuple[list[str], list[Union[str, int, float]]]:
+        """Get the keys and arguments to run the bucket's Lua script with, for a request to given bucket."""
+        keys = [self.get_redis_key(bucket_key, "window"), self.get_redis_key(bucket_key, "cooldown")]
+        return keys, [self.requests, self.time_period, self.cooldown]
+
+    async def handle_request(self, bucket_key: T) -> tuple[int, int]:
+        """
+        Logic occurring on a new call to bucket rate limited route, performed atomically in a single Lua script.
+
+        This performs the same checks as `BucketBase.handle_request`, however instead of going through
+        `get_cooldown`, `get_remaining_requests`, `record_interaction` and `start_cooldown`, each of which
+        needs its own round-trip(s) to redis (and which could race with concurrent requests), the whole
+        check is done by redis within one script call, which also returns the values for the headers.
+        """
+        keys, args = self.get_script_params(bucket_key)
+        allowed, cooldown_ms, remaining_requests, reset_ms = await self.run_script(keys=keys, args=args)
+
+        if not allowed:
+            cooldown_remaining = math.ceil(cooldown_ms / 1000)
+            log.debug(
+                "Request attempt for bucket key %s NOT within ratelimit, interaction prevented,"
+                " %d seconds of cooldown remaining (bucket #%d)",
+                bucket_key,
+                cooldown_remaining,
+                self.bucket_no,
+            )
+            raise OnCooldownError(cooldown_remaining)
 
-        # Cleanup expired entries
-        await self.redis.zremrangebyscore(redis_key, max=time(), min=0)
+        log.debug(
+            "Request attempt for bucket key %s within ratelimit, %d remaining requests (bucket #%d)",
+            bucket_key,
+            remaining_requests,
+            self.bucket_no,
+        )
+        return remaining_requests, max(0, math.ceil(reset_ms / 1000))
 
-        # Get still active entries and subtract them from total allowed requests, getting the reminding requests
-        interactions = int(await self.redis.zcard(redis_key) or 0)
+    async def get_remaining_requests(self, bucket_key: T) -> int:
+        interactions = int(await self.redis.get(self.get_redis_key(bucket_key, "window")) or 0)
         return self.requests - interactions
 
     async def record_interaction(self, bucket_key: T) -> None:
-        redis_key = self.get_redis_key(bucket_key, "interaction")
+        redis_key = self.get_redis_key(bucket_key, "window")
 
-        # We use UUIDs here as something random and unique for each interaction
-        await self.redis.zadd(redis_key, {str(uuid.uuid4()): time() + self.time_period})
+        # The first interaction starts the window. Starting it (along with its expiry) is done within the same
+        # transaction as counting the interaction, so that the counter can never be left without an expiry.
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(redis_key, 0, px=math.ceil(self.time_period * 1000), nx=True)
+            pipe.incr(redis_key)
+            await pipe.execute()
 
     async def start_cooldown(self, bucket_key: T) -> None:
         redis_key = self.get_redis_key(bucket_key, "cooldown")
 
-        await self.redis.set(redis_key, 1)
-        await self.redis.expireat(redis_key, int(time() + self.cooldown))
+        # A single atomic SET with the expiry, NX: an already running cooldown isn't prolonged
+        await self.redis.set(redis_key, 1, px=math.ceil(self.cooldown * 1000), nx=True)
 
     async def get_cooldown(self, bucket_key: T) -> int:
-        redis_key = self.get_redis_key(bucket_key, "cooldown")
+        remaining_ms = await self.redis.pttl(self.get_redis_key(bucket_key, "cooldown"))
+        # PTTL is negative if the key doesn't exist (-2, no cooldown), or if it doesn't expire (-1)
+        return max(0, math.ceil(remaining_ms / 1000))
+
+    async def get_reset_time(self, bucket_key: T) -> int:
+        # The counter resets once the current window ends (the key expires)
+        remaining_ms = await self.redis.pttl(self.get_redis_key(bucket_key, "window"))
+        return max(0, math.ceil(remaining_ms / 1000))
 
-        if not await self.redis.get(redis_key):
-            return 0
 
-        return await self.redis.ttl(redis_key)
+class SlidingWindowRedisBucketBase(RedisBucketBase[T]):
+    """
+    The base class for Redis backed rate-limit buckets counting requests in exact rolling time windows.
 
-    async def get_reset_time(self, bucket_key: T) -> int:
+    Every request within the last `time_period` is kept as a member of a sorted set, which makes this
+    more precise than the fixed windows of `RedisBucketBase`, at the cost of memory proportional
+    to the amount of requests and more work on every request.
+    """
+
+    __slots__ = ()
+
+    lua_script = SLIDING_WINDOW_SCRIPT
+    # Used to produce sorted set members unique for each interaction
+    _interaction_counter = itertools.count()
+
+    def _make_interaction_id(self) -> str:
+        """
+        Produce an unique identifier for a new interaction, to be stored as a sorted set member.
+
+        The members only need to be unique, combining the id of this process (along with a random
+        token, distinguishing processes on different machines) with a counter is enough for that,
+        without needing to generate a new random value (like an UUID) for every interaction.
+        """
+        return f"{_HOST_TOKEN}-{os.getpid()}-{next(self._interaction_counter)}"
+
+    def get_script_params(self, bucket_key: T) -> tuple[list[str], list[Union[str, int, float]]]:
+        keys = [self.get_redis_key(bucket_key, "interaction"), self.get_redis_key(bucket_key, "cooldown")]
+        return keys, [self.time_period, self.requests, self.cooldown, self._make_interaction_id()]
+
+    async def _get_state(self, bucket_key: T) -> tuple[int, int]:
+        """
+        Get the remaining requests and the time until the interactions are reset, for given bucket.
+
+        After obtaining the current (server) time, all of the commands are sent as a single pipeline.
+        """
         redis_key = self.get_redis_key(bucket_key, "interaction")
+        now = await self.get_server_time()
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            # Cleanup expired entries, then count the still active entries and get the entry with highest
+            # score (reset time), since score represents time this will be the interaction entry which
+            # will take longest to get reset
+            pipe.zremrangebyscore(redis_key, max=now, min=0)
+            pipe.zcard(redis_key)
+            pipe.zrange(redis_key, 0, 0, desc=True, withscores=True)
+            _, interactions, newest_entry = await pipe.execute()
+
+        # Scores use absolute time stamps, subtract current time to get seconds reminding. Make sure we don't
+        # return a negative number, it's possible that this interaction has already reached it's reset time.
+        reset_time = max(0, int(newest_entry[0][1] - now)) if newest_entry else 0
+        return self.requests - interactions, reset_time
+
+    async def get_remaining_requests(self, bucket_key: T) -> int:
+        remaining_interactions, _ = await self._get_state(bucket_key)
+        return remaining_interactions
+
+    async def record_interaction(self, bucket_key: T) -> None:
+        redis_key = self.get_redis_key(bucket_key, "interaction")
+
+        expires_at = await self.get_server_time() + self.time_period
+        await self.redis.zadd(redis_key, {self._make_interaction_id(): expires_at})
 
-        # Get the entry (uuid) with highest score (reset time), since score represents time
-        # this will be the interaction entry which will take longest to get reset
-        newest_uuid = await self.redis.zrange(redis_key, 0, 0, desc=True, withscores=True)
+    async def get_reset_time(self, bucket_key: T) -> int:
+        _, time_until_reset = await self._get_state(bucket_key)
+        return time_until_reset
+
+
+# Atomically check the cooldown and the theoretical arrival time (TAT) of the next request of a GCRA
+# (generic cell rate algorithm) bucket, advancing the TAT by an emission interval for each of the (up to
+# `requested`) granted requests, or starting the cooldown if no request can be granted.
+# KEYS: TAT key, cooldown key; ARGV: emission interval, period, cooldown (all in milliseconds), requested
+# Returns {granted requests, remaining requests, milliseconds until the bucket is fully replenished / until
+# the cooldown ends}.
+GCRA_SCRIPT = """
+redis.replicate_commands()
+local tat_key = KEYS[1]
+local cooldown_key = KEYS[2]
+local emission_interval = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local cooldown = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+
+local server_time = redis.call('TIME')
+local now = tonumber(server_time[1]) * 1000 + tonumber(server_time[2]) / 1000
+
+local cooldown_remaining = redis.call('PTTL', cooldown_key)
+if cooldown_remaining > 0 then
+    return {0, 0, cooldown_remaining}
+end
+
+local tat = math.max(tonumber(redis.call('GET', tat_key)) or now, now)
+local available = math.floor((period - (tat - now)) / emission_interval)
+local granted = math.min(requested, available)
+
+if granted <= 0 then
+    redis.call('SET', cooldown_key, 1, 'PX', cooldown)
+    return {0, 0, cooldown}
+end
 
-        if not newest_uuid:
-            return 0
+local new_tat = tat + granted * emission_interval
 
-        # Scores use absolute time stamps, subtract current time to get seconds reminding
-        rem_seconds = int(newest_uuid[0][1] - time())
+local replenish_time = math.ceil(new_tat - now)
+redis.call('SET', tat_key, new_tat, 'PX', replenish_time)
+return {granted, available - granted, replenish_time}
+"""
 
-        # Make sure we don't return a negative number, it's possible that this interaction has
-        # already reached it's reset time and just wasn't removed yet.
-        return max(0, rem_seconds)
+
+class GCRARedisBucketBase(RedisBucketBase[T]):
+    """
+    The base class for Redis backed rate-limit buckets using GCRA (generic cell rate algorithm).
+
+    GCRA is a leaky bucket used as a meter: each request moves the theoretical arrival time (TAT)
+    of the next request by `time_period / requests` into the future, and a request is refused if
+    that would move the TAT further than `time_period` ahead of now. This gives rolling window
+    semantics (up to `requests` per `time_period`, replenishing continuously), with the whole state
+    of the bucket being a single number, checked and updated by a Lua script in a single round-trip.
+
+    To avoid going to redis on every request, each process takes the requests from redis in batches
+    of up to `local_allowance` requests, spending them locally before asking redis for more.
+    """
+
+    __slots__ = ("local_allowance", "_period_ns", "_local", "_denied")
+
+    lua_script = GCRA_SCRIPT
+
+    def __init__(
+        self,
+        *,
+        requests: int,
+        time_period: float,
+        cooldown: float,
+        name: Optional[str] = None,
+        redis: Optional[Redis] = None,
+        local_allowance: Optional[int] = None,
+    ):
+        """
+        GCRA bucket constructor, see `RedisBucketBase` for the other parameters.
+
+        :param local_allowance: The maximum amount of requests taken from redis at once, to be then spent by this
+            process without asking redis. Requests taken this way are already counted against the limit, however
+            as they can be spent for up to `time_period`, the limit can be exceeded by up to this amount (per
+            process). Defaults to a tenth of `requests` (at least 1, which means no batching).
+        """
+        super().__init__(requests=requests, time_period=time_period, cooldown=cooldown, name=name, redis=redis)
+        self.local_allowance = local_allowance if local_allowance is not None else max(1, requests // 10)
+
+        # All of the local timers below are integer nanoseconds of the monotonic clock (unaffected by any
+        # adjustments of the system clock), the redis state itself is only ever timed by the redis server.
+        self._period_ns = int(time_period * 1_000_000_000)
+
+        # Requests taken from redis, which weren't yet spent, along with the (monotonic) time until which they
+        # can be spent, and the remaining requests in redis with the (monotonic) time of the bucket being fully
+        # replenished, as returned when taking them (for the headers), keyed by bucket key. Since there is no
+        # await between checking and spending these, this doesn't need any locking.
+        self._local: TTLCache[T, tuple[int, int, int, int]] = TTLCache(maxsize=100_000, ttl=time_period)
+
+        # Bucket keys which were recently refused by redis, mapped to the (monotonic) time until which
+        # they will keep being refused. Repeated requests from these keys (e.g. floods) are then refused
+        # right away, without making any redis requests.
+        self._denied: TTLCache[T, int] = TTLCache(maxsize=100_000, ttl=max(cooldown, time_period))
+
+    @property
+    def emission_interval(self) -> float:
+        """The time in milliseconds, by which each request moves the TAT."""
+        return self.time_period * 1000 / self.requests
+
+    def get_script_params(
+        self,
+        bucket_key: T,
+        requested: int = 1,
+    ) -> tuple[list[str], list[Union[str, int, float]]]:
+        keys = [self.get_redis_key(bucket_key, "tat"), self.get_redis_key(bucket_key, "cooldown")]
+        cooldown = math.ceil(self.cooldown * 1000)
+        return keys, [self.emission_interval, self.time_period * 1000, cooldown, requested]
+
+    async def _get_state(self, bucket_key: T) -> tuple[int, int]:
+        """Get the remaining requests and the time in milliseconds until the bucket is fully replenished."""
+        # Requests taken from redis into the local allowance are still available to this process
+        spend_until, allowance, _, _ = self._local.get(bucket_key, (0, 0, 0, 0))
+        if spend_until <= monotonic_ns():
+            allowance = 0
+
+        # The TAT is in the redis server's time, obtain it along with the TAT, in a single round-trip
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(self.get_redis_key(bucket_key, "tat"))
+            pipe.time()
+            tat, (seconds, microseconds) = await pipe.execute()
+        if tat is None:
+            return self.requests, 0
+
+        now = seconds * 1000 + microseconds / 1000
+        replenish_time = max(0, float(tat) - now)
+        remaining = math.floor((self.time_period * 1000 - replenish_time) / self.emission_interval)
+        return remaining + allowance, math.ceil(replenish_time)
+
+    async def handle_request(self, bucket_key: T) -> tuple[int, int]:
+        """
+        Check and record the request in a single atomic step, raising OnCooldownError if it isn't allowed.
+
+        When the request is spent from the local allowance, the returned remaining requests and reset time are
+        based on the state of redis when the allowance was taken, which avoids making any redis requests at all.
+        """
+        now = monotonic_ns()
+        deny_until = self._denied.get(bucket_key)
+        if deny_until is not None:
+            if deny_until > now:
+                log.debug("Request attempt for locally denied bucket key %s (bucket #%d)", bucket_key, self.bucket_no)
+                raise OnCooldownError(math.ceil((deny_until - now) / 1_000_000_000))
+            self._denied.pop(bucket_key, None)
+
+        spend_until, allowance, remaining, replenish_at = self._local.get(bucket_key, (0, 0, 0, 0))
+        if allowance > 0 and spend_until > now:
+            log.debug(
+                "Request attempt for bucket key %s within local allowance (bucket #%d)", bucket_key, self.bucket_no
+            )
+            self._local[bucket_key] = (spend_until, allowance - 1, remaining, replenish_at)
+            return remaining + allowance - 1, max(0, math.ceil((replenish_at - now) / 1_000_000_000))
+
+        keys, args = self.get_script_params(bucket_key, self.local_allowance)
+        granted, remaining, remaining_ms = await self.run_script(keys=keys, args=args)
+        now = monotonic_ns()
+        if not granted:
+            self._denied[bucket_key] = now + remaining_ms * 1_000_000
+            log.debug(
+                "Request attempt for bucket key %s NOT within ratelimit, interaction prevented,"
+                " %d ms of cooldown remaining (bucket #%d)",
+                bucket_key,
+                remaining_ms,
+                self.bucket_no,
+            )
+            raise OnCooldownError(math.ceil(remaining_ms / 1000))
+
+        # Keep the rest of the granted requests for the following requests of this bucket key
+        spend_until, allowance, _, _ = self._local.get(bucket_key, (0, 0, 0, 0))
+        if spend_until <= now:
+            allowance = 0
+        allowance += granted - 1
+        if allowance > 0:
+            self._local[bucket_key] = (now + self._period_ns, allowance, remaining, now + remaining_ms * 1_000_000)
+
+        log.debug(
+            "Request attempt for bucket key %s within ratelimit, %d remaining requests (bucket #%d)",
+            bucket_key,
+            remaining,
+            self.bucket_no,
+        )
+        return remaining + allowance, math.ceil(remaining_ms / 1000)
+
+    async def get_remaining_requests(self, bucket_key: T) -> int:
+        remaining, _ = await self._get_state(bucket_key)
+        return remaining
+
+    async def record_interaction(self, bucket_key: T) -> None:
+        keys, args = self.get_script_params(bucket_key)
+        await self.run_script(keys=keys, args=args)
+
+    async def get_reset_time(self, bucket_key: T) -> int:
+        _, reset_ms = await self._get_state(bucket_key)
+        return math.ceil(reset_ms / 1000)
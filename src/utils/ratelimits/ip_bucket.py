@@ -3,24 +3,28 @@ import logging
 from fastapi.requests import Request
 from fastapi.responses import Response
 
-from src.utils.ratelimits.abc import RedisBucketBase
+from src.utils.ratelimits.abc import GCRARedisBucketBase
+
+__all__ = ["IPRedisBucket"]
 
 log = logging.getLogger(__name__)
 
 
-class IPRedisBucket(RedisBucketBase[str]):
-    """A per IP request bucket backed by Redis."""
+class IPRedisBucket(GCRARedisBucketBase[str]):
+    """A per IP request (GCRA) bucket backed by Redis."""
+
+    __slots__ = ()
 
     async def get_bucket_key(self, request: Request) -> str:
-        """Obtain the IP address from request as the bucket key."""
-        if request.client is None:
+        """Obtain the IP address (stored into the request state by the session middleware) as the bucket key."""
+        host_address = request.state.bucket_ip
+        if host_address is None:
             raise ValueError("Unable to obtain client's IP.")
 
-        host_address, _ = request.client.host
-        log.debug(f"Obtained bucket key for rate-limited route: {host_address} (bucket #{self.bucket_no})")
+        log.debug("Obtained bucket key for rate-limited route: %s (bucket #%d)", host_address, self.bucket_no)
         return host_address
 
-    async def add_headers(self, response: Response, bucket_key: str) -> None:
+    async def add_headers(self, response: Response, remaining_interactions: int, time_until_reset: int) -> None:
         """
         Override add_headers since we don't want to be informing the user about ip-based rate-limits.
 
@@ -35,4 +39,4 @@ class IPRedisBucket(RedisBucketBase[str]):
         This avoids conflicts with other buckets, and makes it clear that if this header appears,
         the API is under a ip-wide cooldown which should be respected.
         """
-        response.headers.append("Ip-Cooldown-Reset", str(remaining_seconds))
+        response.raw_headers.append((b"ip-cooldown-reset", str(remaining_seconds).encode("latin-1")))
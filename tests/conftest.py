@@ -0,0 +1,7 @@
+import os
+
+# The configuration is read on import of the application, make sure the required values are present.
+# No actual connections are made to these, the tests use fake clients instead.
+os.environ.setdefault("DATABASE_URL", "user:password@localhost/test")
+os.environ.setdefault("REDIS_URL", "redis://localhost")
+os.environ.setdefault("JWT_SECRET", "test-secret")
@@ -0,0 +1,29 @@
+from fakeredis.aioredis import FakeRedis
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.testclient import TestClient
+
+from src.api import SessionMiddleware
+from src.utils.database import call_after_commit
+
+
+def test_error_response_rolls_back() -> None:
+    committed = []
+
+    app = FastAPI()
+    app.state.redis = FakeRedis()
+    app.state.httpx_client = None
+    app.add_middleware(SessionMiddleware)
+
+    @app.get("/{status}")
+    async def route(request: Request, status: int) -> Response:
+        call_after_commit(lambda: committed.append(status))
+        if status >= 400:
+            raise HTTPException(status)
+        return Response(status_code=status)
+
+    client = TestClient(app)
+    assert client.get("/200").status_code == 200
+    assert client.get("/404").status_code == 404
+    assert client.get("/422").status_code == 422
+    # Only the successful request got its changes committed
+    assert committed == [200]
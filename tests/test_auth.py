@@ -0,0 +1,51 @@
+import asyncio
+from collections.abc import Iterator
+from typing import Optional
+
+import pytest
+from fastapi import HTTPException
+
+from src import crud
+from src.models import Member
+from src.utils import auth
+
+
+@pytest.fixture
+def members(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict[int, Member]]:
+    """Members which can be looked up by the token validation, instead of the ones from the database."""
+    members: dict[int, Member] = {}
+
+    async def get_member(member_id: int, *, session: None = None) -> Optional[Member]:
+        return members.get(member_id)
+
+    monkeypatch.setattr(crud, "get_member", get_member)
+    auth._member_cache.clear()
+    yield members
+    auth._member_cache.clear()
+
+
+def test_validate_token_matching_salt(members: dict[int, Member]) -> None:
+    token, salt = auth._make_member_token(5)
+    members[5] = Member(member_id=5, is_admin=False, key_salt=salt)
+
+    token_data, member = asyncio.run(auth.validate_token(token))
+    assert token_data["id"] == 5
+    assert member.member_id == 5
+
+
+def test_validate_token_mismatched_salt(members: dict[int, Member]) -> None:
+    token, _ = auth._make_member_token(5)
+    _, new_salt = auth._make_member_token(5)  # Token was reset, the old one is no longer valid
+    members[5] = Member(member_id=5, is_admin=False, key_salt=new_salt)
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(auth.validate_token(token))
+    assert exc_info.value.status_code == 403
+
+
+def test_validate_token_missing_member(members: dict[int, Member]) -> None:
+    token, _ = auth._make_member_token(5)
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(auth.validate_token(token))
+    assert exc_info.value.status_code == 403
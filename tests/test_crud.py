@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from src import crud, models
+from src.utils.cache import _request_redis
+from src.utils.database import run_after_commit
+
+
+class FakeSession:
+    """Database session stand-in, only tracking the session info, which holds the after commit callbacks."""
+
+    def __init__(self):
+        self.info = {}
+
+    async def delete(self, instance: object) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
+
+
+def test_cache_invalidated_after_commit(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def get_db_post(id: int, *, session: FakeSession) -> models.Post:
+        return models.Post(id=id, user_id=2, title="title", body="body")
+
+    monkeypatch.setattr(crud, "_get_db_post", get_db_post)
+
+    async def run() -> None:
+        redis = FakeRedis()
+        _request_redis.set(redis)
+        session = FakeSession()
+        await crud.cache_set("post:1", {"id": 1, "user_id": 2, "title": "title", "body": "body"}, 60)
+
+        assert await crud.delete_post(1, session=session)  # type: ignore # fake session
+        # The transaction isn't committed yet, concurrent requests still see the old post
+        assert await redis.exists("post:1")
+
+        await run_after_commit(session)  # type: ignore # fake session
+        assert not await redis.exists("post:1")
+        assert "after_commit" not in session.info
+
+    asyncio.run(run())
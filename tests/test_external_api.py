@@ -0,0 +1,99 @@
+import asyncio
+
+import httpx
+import pytest
+from fakeredis.aioredis import FakeRedis
+from fastapi import BackgroundTasks
+
+from src import crud, models
+from src.utils import external_api
+from src.utils.cache import _request_redis
+
+POST_DATA = {"id": 1, "userId": 2, "title": "title", "body": "body"}
+
+
+def make_client(calls: list[httpx.Request], delay: float = 0) -> httpx.AsyncClient:
+    """Make a client for the (fake) external API, recording all of the made requests."""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json=POST_DATA)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="https://api.test")
+
+
+def test_lookup_post_cache_hit_makes_no_api_call() -> None:
+    calls = []
+
+    async def run() -> None:
+        redis = FakeRedis()
+        _request_redis.set(redis)
+        await crud.cache_set("post:1", {"id": 1, "user_id": 2, "title": "title", "body": "body"}, 60)
+        for _ in range(5):
+            post = await external_api.lookup_post(make_client(calls), redis, BackgroundTasks(), 1)
+            assert post is not None
+            assert post.id == 1
+
+    asyncio.run(run())
+    assert calls == []
+
+
+def test_lookup_post_db_hit_makes_no_api_call(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls = []
+
+    async def get_db_post(id: int, *, session: None = None) -> models.Post:
+        return models.Post(id=id, user_id=2, title="title", body="body")
+
+    monkeypatch.setattr(crud, "_get_db_post", get_db_post)
+
+    async def run() -> None:
+        redis = FakeRedis()
+        for _ in range(5):
+            post = await external_api.lookup_post(make_client(calls), redis, BackgroundTasks(), 1)
+            assert post is not None
+
+    asyncio.run(run())
+    assert calls == []
+
+
+def test_lookup_post_miss_is_deduplicated(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls = []
+
+    async def get_db_post(id: int, *, session: None = None) -> None:
+        return None
+
+    monkeypatch.setattr(crud, "_get_db_post", get_db_post)
+
+    async def run() -> None:
+        redis = FakeRedis()
+        client = make_client(calls, delay=0.05)
+        posts = await asyncio.gather(
+            *(external_api.lookup_post(client, redis, BackgroundTasks(), 1) for _ in range(5))
+        )
+        assert all(post is not None and post.id == 1 for post in posts)
+
+    asyncio.run(run())
+    assert len(calls) == 1
+
+
+def test_api_lookup_cancelled_with_last_waiter() -> None:
+    calls = []
+
+    async def run() -> None:
+        client = make_client(calls, delay=10)
+        waiters = [asyncio.create_task(external_api._lookup_api_post(client, 1)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        lookup = external_api._inflight_lookups[1]
+
+        waiters[0].cancel()
+        await asyncio.sleep(0.01)
+        assert not lookup.cancelled()
+
+        waiters[1].cancel()
+        await asyncio.sleep(0.01)
+        assert lookup.cancelled()
+        assert 1 not in external_api._inflight_lookups
+
+    asyncio.run(run())
+    assert len(calls) == 1
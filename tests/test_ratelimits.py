@@ -0,0 +1,64 @@
+import asyncio
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager
+
+import httpx
+import orjson
+import pytest
+from fakeredis.aioredis import FakeRedis
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from src.api import app
+from src.utils.ratelimits.abc import GCRARedisBucketBase, GCRA_SCRIPT, RedisBucketBase
+
+POST = {"id": 1, "user_id": 2, "title": "title", "body": "body"}
+
+
+@pytest.fixture
+def client(monkeypatch: pytest.MonkeyPatch) -> Iterator[TestClient]:
+    """Client for the app, with fake redis and API clients instead of the real connections made on startup."""
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        app.state.redis = FakeRedis(decode_responses=True)
+        # The post is only ever looked up from the cache, the database or the API are never reached
+        await app.state.redis.set("post:1", orjson.dumps(POST))
+        async with httpx.AsyncClient(transport=httpx.MockTransport(lambda _: httpx.Response(500))) as httpx_client:
+            app.state.httpx_client = httpx_client
+            yield
+
+    monkeypatch.setattr(app.router, "lifespan_context", lifespan)
+    # Fakeredis doesn't implement script effects replication (which is the default since redis 5 anyways)
+    monkeypatch.setattr(GCRARedisBucketBase, "lua_script", GCRA_SCRIPT.replace("redis.replicate_commands()\n", ""))
+    with TestClient(app) as client:
+        yield client
+
+
+def test_get_post_ratelimited(client: TestClient) -> None:
+    for _ in range(20):
+        response = client.get("/post/1")
+        assert response.status_code == 200
+        assert response.json() == POST
+
+    response = client.get("/post/1")
+    assert response.status_code == 429
+    assert int(response.headers["ip-cooldown-reset"]) > 0
+
+
+class FixedWindowBucket(RedisBucketBase[str]):
+    __slots__ = ()
+
+    async def get_bucket_key(self, request: Request) -> str:
+        return "key"
+
+
+def test_fixed_window_record_interaction_expires() -> None:
+    async def run() -> None:
+        bucket = FixedWindowBucket(requests=3, time_period=20, cooldown=50, redis=FakeRedis(), name="fixed")
+        for remaining in (2, 1, 0):
+            await bucket.record_interaction("key")
+            assert await bucket.get_remaining_requests("key") == remaining
+            assert 0 < await bucket.get_reset_time("key") <= 20
+
+    asyncio.run(run())